@@ -144,6 +144,7 @@
     startup_notification_handler,
     timed_debug_print,
     which,
+    which_in_path,
 )
 from .window import CommandOutput, CwdRequest, Window
 
@@ -2701,6 +2702,7 @@ def load_config_file(self, *paths: str, apply_overrides: bool = True, overrides:
         clear_caches()
         from .guess_mime_type import clear_mime_cache
         clear_mime_cache()
+        which_in_path.cache_clear()
 
     def safe_delete_temp_file(self, path: str) -> None:
         if is_path_in_temp_dir(path):
@@ -40,11 +40,26 @@ def process_group_map() -> DefaultDict[int, list[int]]:
 
     def cmdline_of_pid(pid: int) -> list[str]:
         return cmdline_(pid)
+
+    def cmdline_of_pid_containing(pid: int, needle: bytes) -> list[str]:
+        ans = cmdline_(pid)
+        q = needle.decode('utf-8')
+        return ans if any(q in x for x in ans) else []
 else:
 
+    def decode_cmdline(raw: bytes) -> list[str]:
+        return list(filter(None, raw.decode('utf-8').split('\0')))
+
     def cmdline_of_pid(pid: int) -> list[str]:
         with open(f'/proc/{pid}/cmdline', 'rb') as f:
-            return list(filter(None, f.read().decode('utf-8').split('\0')))
+            return decode_cmdline(f.read())
+
+    def cmdline_of_pid_containing(pid: int, needle: bytes) -> list[str]:
+        # Returns an empty list when needle is not in the command line, checked
+        # before decoding, which is much faster when scanning many processes
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            raw = f.read()
+        return decode_cmdline(raw) if needle in raw else []
 
     if is_freebsd:
         def cwd_of_process(pid: int) -> str:
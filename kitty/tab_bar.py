@@ -31,7 +31,7 @@
 from .rgb import alpha_blend, color_as_sgr, color_from_int, to_color
 from .types import WindowGeometry, run_once
 from .typing import EdgeLiteral, PowerlineStyle
-from .utils import color_as_int, log_error, sgr_sanitizer_pat
+from .utils import color_as_int, log_error, sgr_split_pat
 
 
 class TabBarData(NamedTuple):
@@ -173,7 +173,7 @@ class ExtraData:
 
 def draw_attributed_string(title: str, screen: Screen) -> None:
     if '\x1b' in title:
-        for x in sgr_sanitizer_pat(for_splitting=True).split(title):
+        for x in sgr_split_pat.split(title):
             if x.startswith('\x1b') and x.endswith('m'):
                 screen.apply_sgr(x[2:-1])
             else:
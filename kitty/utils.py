@@ -7,12 +7,15 @@
 import math
 import os
 import re
+import select
+import stat
 import string
+import struct
 import sys
+import termios
 from collections.abc import Generator, Iterable, Iterator, Mapping, Sequence
 from contextlib import contextmanager, suppress
 from functools import lru_cache
-from re import Match, Pattern
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -51,55 +54,72 @@
 
 class Flag:
 
+    __slots__ = ('val', 'initial_val', 'saved')
+
     def __init__(self, initial_val: bool = True) -> None:
-        self.val = initial_val
+        self.val = self.initial_val = initial_val
+        self.saved: list[bool] = []
 
     def __enter__(self) -> None:
-        self.val ^= True
+        self.saved.append(self.val)
+        self.val = not self.initial_val
 
     def __exit__(self, *a: object) -> None:
-        self.val ^= True
+        self.val = self.saved.pop()
 
     def __bool__(self) -> bool:
         return self.val
 
 
 disallow_expand_vars = Flag(False)
+expandvars_pat = re.compile(r'\$(?:(\w+)|\{([^}]+)\})')
+title_control_chars_pat = re.compile(r'[\0-\x19\x80-\x9f]')
+whitespace_pat = re.compile(r'\s+')
+# matches anything sanitize_title() would change
+title_needs_sanitizing_pat = re.compile(r'[\0-\x19\x80-\x9f]|[^\S ]|  ')
+digits_pat = re.compile(r'(\d+)')
 
 
 def expandvars(val: str, env: Mapping[str, str] = {}, fallback_to_os_env: bool = True) -> str:
     '''
     Expand $VAR and ${VAR} Use $$ for a literal $
     '''
+    if disallow_expand_vars or '$' not in val:
+        return val
 
-    def sub(m: 'Match[str]') -> str:
+    env_get = env.get
+    os_env_get = os.environ.get
+    src = val.replace('$$', '\0')
+    parts: list[str] = []
+    append = parts.append
+    pos = 0
+    for m in expandvars_pat.finditer(src):
         key = m.group(1) or m.group(2)
-        result = env.get(key)
+        result = env_get(key)
         if result is None and fallback_to_os_env:
-            result = os.environ.get(key)
+            result = os_env_get(key)
         if result is None:
             result = m.group()
-        return result
+        append(src[pos:m.start()])
+        append(result)
+        pos = m.end()
+    append(src[pos:])
+    return ''.join(parts).replace('\0', '$')
 
-    if disallow_expand_vars or '$' not in val:
-        return val
 
-    return re.sub(r'\$(?:(\w+)|\{([^}]+)\})', sub, val.replace('$$', '\0')).replace('\0', '$')
+sgr_pat = re.compile('\033\\[.*?m')
+sgr_split_pat = re.compile('(\033\\[.*?m)')
+# removes ANSI sequences generated by kitty's ANSI output routines. Not
+# suitable for stripping general ANSI sequences
+kitty_ansi_pat = re.compile(r'\x1b(?:\[[0-9;:]*?m|\].*?\x1b\\)')
 
 
-@lru_cache(maxsize=2)
 def sgr_sanitizer_pat(for_splitting: bool = False) -> 're.Pattern[str]':
-    pat = '\033\\[.*?m'
-    if for_splitting:
-        return re.compile(f'({pat})')
-    return re.compile(pat)
+    return sgr_split_pat if for_splitting else sgr_pat
 
 
-@run_once
 def kitty_ansi_sanitizer_pat() -> 're.Pattern[str]':
-    # removes ANSI sequences generated by kitty's ANSI output routines. Not
-    # suitable for stripping general ANSI sequences
-    return re.compile(r'\x1b(?:\[[0-9;:]*?m|\].*?\x1b\\)')
+    return kitty_ansi_pat
 
 
 def platform_window_id(os_window_id: int) -> Optional[int]:
@@ -145,11 +165,13 @@ def ceil_int(x: float) -> int:
 
 
 def sanitize_title(x: str) -> str:
-    return re.sub(r'\s+', ' ', re.sub(r'[\0-\x19\x80-\x9f]', '', x))
+    if title_needs_sanitizing_pat.search(x) is None:
+        return x
+    return whitespace_pat.sub(' ', title_control_chars_pat.sub('', x))
 
 
 def color_as_int(val: Color) -> int:
-    return int(val) & 0xffffff
+    return val.rgb
 
 
 def color_from_int(val: int) -> Color:
@@ -165,15 +187,15 @@ class ScreenSize(NamedTuple):
     cell_height: int
 
 
+winsize = struct.Struct('HHHH')
+
+
 def read_screen_size(fd: int = -1) -> ScreenSize:
-    import array
-    import fcntl
-    import termios
-    buf = array.array('H', [0, 0, 0, 0])
+    buf = bytearray(winsize.size)
     if fd < 0:
         fd = sys.stdout.fileno()
-    fcntl.ioctl(fd, termios.TIOCGWINSZ, cast(bytearray, buf))
-    rows, cols, width, height = tuple(buf)
+    fcntl.ioctl(fd, termios.TIOCGWINSZ, buf)
+    rows, cols, width, height = winsize.unpack_from(buf)
     cell_width, cell_height = width // (cols or 1), height // (rows or 1)
     return ScreenSize(rows, cols, width, height, cell_width, cell_height)
 
@@ -201,18 +223,13 @@ def screen_size_function(fd: Optional[int] = None) -> ScreenSizeGetter:
 
 
 def fit_image(width: int, height: int, pwidth: int, pheight: int) -> tuple[int, int]:
-    from math import floor
-    if height > pheight:
-        corrf = pheight / float(height)
-        width, height = floor(corrf * width), pheight
-    if width > pwidth:
-        corrf = pwidth / float(width)
-        width, height = pwidth, floor(corrf * height)
-    if height > pheight:
-        corrf = pheight / float(height)
-        width, height = floor(corrf * width), pheight
-
-    return int(width), int(height)
+    if width <= pwidth and height <= pheight:
+        return width, height
+    if not width or not height:  # a zero size image cannot be scaled
+        return min(width, pwidth), min(height, pheight)
+    if pwidth * height > pheight * width:  # height is the limiting dimension
+        return width * pheight // height, pheight
+    return pwidth, height * pwidth // width
 
 
 def base64_encode(
@@ -220,13 +237,8 @@ def base64_encode(
     chars: str = string.ascii_uppercase + string.ascii_lowercase + string.digits +
     '+/'
 ) -> str:
-    ans = ''
-    while True:
-        integer, remainder = divmod(integer, 64)
-        ans = chars[remainder] + ans
-        if integer == 0:
-            break
-    return ans
+    num_digits = max(1, (integer.bit_length() + 5) // 6)
+    return ''.join([chars[(integer >> shift) & 63] for shift in range(6 * (num_digits - 1), -1, -6)])
 
 
 def command_for_open(program: Union[str, list[str]] = 'default') -> list[str]:
@@ -384,7 +396,6 @@ def unix_socket_paths(name: str, ext: str = '.lock') -> Generator[str, None, Non
 def random_unix_socket() -> 'Socket':
     import shutil
     import socket
-    import stat
     import tempfile
 
     from kitty.fast_data_types import random_unix_socket as rus
@@ -495,17 +506,31 @@ def parse_address_spec(spec: str) -> tuple[AddressFamily, Union[tuple[str, int],
     return family, address, socket_path
 
 
+os_window_states: Mapping[str, int] = {
+    'normal': WINDOW_NORMAL, 'maximized': WINDOW_MAXIMIZED, 'minimized': WINDOW_MINIMIZED,
+    'fullscreen': WINDOW_FULLSCREEN, 'fullscreened': WINDOW_FULLSCREEN
+}
+
+
 def parse_os_window_state(state: str) -> int:
-    return {
-        'normal': WINDOW_NORMAL, 'maximized': WINDOW_MAXIMIZED, 'minimized': WINDOW_MINIMIZED,
-        'fullscreen': WINDOW_FULLSCREEN, 'fullscreened':WINDOW_FULLSCREEN
-    }[state]
+    return os_window_states[state]
 
 
 def write_all(fd: int, data: Union[str, bytes], block_until_written: bool = True) -> None:
     if isinstance(data, str):
         data = data.encode('utf-8')
-    mvd = memoryview(data)
+    if not data:
+        return
+    try:
+        n = os.write(fd, data)
+    except BlockingIOError:
+        if not block_until_written:
+            raise
+        n = 0
+    else:
+        if n == len(data) or not n:
+            return
+    mvd = memoryview(data)[n:]
     while len(mvd) > 0:
         try:
             n = os.write(fd, mvd)
@@ -534,7 +559,6 @@ def __exit__(self, *a: Any) -> None:
     def wait_till_read_available(self) -> bool:
         if self.read_with_timeout:
             raise ValueError('Cannot wait when TTY is set to read with timeout')
-        import select
         rd = select.select([self.tty_fd], [], [])[0]
         return bool(rd)
 
@@ -560,7 +584,6 @@ def recv(self, more_needed: Callable[[bytes], bool], timeout: float, sz: int = 1
 
 
 def set_echo(fd: int = -1, on: bool = False) -> tuple[int, list[Union[int, list[Union[bytes, int]]]]]:
-    import termios
     if fd < 0:
         fd = sys.stdin.fileno()
     old = termios.tcgetattr(fd)
@@ -575,7 +598,6 @@ def set_echo(fd: int = -1, on: bool = False) -> tuple[int, list[Union[int, list[
 
 @contextmanager
 def no_echo(fd: int = -1) -> Iterator[None]:
-    import termios
     fd, old = set_echo(fd)
     try:
         yield
@@ -583,15 +605,17 @@ def no_echo(fd: int = -1) -> Iterator[None]:
         termios.tcsetattr(fd, termios.TCSADRAIN, old)
 
 
-def natsort_ints(iterable: Iterable[str]) -> list[str]:
-
-    def convert(text: str) -> Union[int, str]:
-        return int(text) if text.isdigit() else text
+def natsort_key(key: str) -> tuple[Union[int, str], ...]:
+    # splitting on a capturing group puts the runs of digits at the odd indices
+    parts: list[Union[int, str]] = list(digits_pat.split(key))
+    as_int = int
+    for i in range(1, len(parts), 2):
+        parts[i] = as_int(parts[i])
+    return tuple(parts)
 
-    def alphanum_key(key: str) -> tuple[Union[int, str], ...]:
-        return tuple(map(convert, re.split(r'(\d+)', key)))
 
-    return sorted(iterable, key=alphanum_key)
+def natsort_ints(iterable: Iterable[str]) -> list[str]:
+    return sorted(iterable, key=natsort_key)
 
 
 def get_hostname(fallback: str = '') -> str:
@@ -676,26 +700,27 @@ def get_editor(opts: Optional[Options] = None, path_to_edit: str = '', line_numb
     return ans
 
 
-def is_path_in_temp_dir(path: str) -> bool:
-    if not path:
-        return False
+def abspath_resolving_symlinks(x: Optional[str]) -> str:
+    if x:
+        x = os.path.abspath(os.path.realpath(x))
+    return x or ''
 
-    def abspath(x: Optional[str]) -> str:
-        if x:
-            x = os.path.abspath(os.path.realpath(x))
-        return x or ''
 
+@run_once
+def temp_dir_candidates() -> tuple[str, ...]:
+    # Note that changes to TMPDIR after the first call are not picked up
     import tempfile
-    path = abspath(path)
-    candidates = frozenset(map(abspath, ('/tmp', '/dev/shm', os.environ.get('TMPDIR', None), tempfile.gettempdir())))
-    for q in candidates:
-        if q and path.startswith(q):
-            return True
-    return False
+    return tuple(filter(None, frozenset(map(abspath_resolving_symlinks, (
+        '/tmp', '/dev/shm', os.environ.get('TMPDIR', None), tempfile.gettempdir())))))
+
+
+def is_path_in_temp_dir(path: str) -> bool:
+    if not path:
+        return False
+    return abspath_resolving_symlinks(path).startswith(temp_dir_candidates())
 
 
 def is_ok_to_read_image_file(path: str, fd: int) -> bool:
-    import stat
     path = os.path.abspath(os.path.realpath(path))
     try:
         path_stat = os.stat(path, follow_symlinks=True)
@@ -784,10 +809,16 @@ def add_from_file(x: str) -> None:
     return tuple(entries)
 
 
+@lru_cache(maxsize=256)
+def which_in_path(name: str, path: str) -> Optional[str]:
+    # Results, including negative ones, are cached until the config is reloaded
+    import shutil
+    return shutil.which(name, path=path)
+
+
 def which(name: str, only_system: bool = False) -> Optional[str]:
     if os.sep in name:
         return name
-    import shutil
 
     opts: Optional[Options] = None
     with suppress(RuntimeError):
@@ -812,7 +843,7 @@ def which(name: str, only_system: bool = False) -> Optional[str]:
     paths.append(os.path.expanduser('~/.local/bin'))
     paths.append(os.path.expanduser('~/bin'))
     paths.extend(append_paths)
-    ans = shutil.which(name, path=os.pathsep.join(x for x in paths if x not in tried_paths))
+    ans = which_in_path(name, os.pathsep.join(x for x in paths if x not in tried_paths))
     if ans:
         return ans
     # In case PATH is messed up try a default set of paths
@@ -823,7 +854,7 @@ def which(name: str, only_system: bool = False) -> Optional[str]:
     tried_paths |= set(paths)
     system_paths = tuple(x for x in system_paths if x not in tried_paths)
     if system_paths:
-        ans = shutil.which(name, path=os.pathsep.join(system_paths))
+        ans = which_in_path(name, os.pathsep.join(system_paths))
         if ans:
             return ans
         tried_paths |= set(system_paths)
@@ -834,69 +865,81 @@ def which(name: str, only_system: bool = False) -> Optional[str]:
         q = xenv.get('PATH')
         if q:
             paths = [x for x in xenv['PATH'].split(os.pathsep) if x not in tried_paths]
-            ans = shutil.which(name, path=os.pathsep.join(paths))
+            ans = which_in_path(name, os.pathsep.join(paths))
             if ans:
                 return ans
             tried_paths |= set(paths)
     return None
 
 
-def read_shell_environment(opts: Optional[Options] = None) -> dict[str, str]:
-    ans: Optional[dict[str, str]] = getattr(read_shell_environment, 'ans', None)
-    if ans is None:
-        from .child import openpty
-        ans = {}
-        setattr(read_shell_environment, 'ans', ans)
-        import subprocess
-        shell = resolved_shell(opts)
-        master, slave = openpty()
-        os.set_blocking(master, False)
-        if '-l' not in shell and '--login' not in shell:
-            shell += ['-l']
-        if '-i' not in shell and '--interactive' not in shell:
-            shell += ['-i']
-        try:
-            p = subprocess.Popen(
-                shell + ['-c', 'env'], stdout=slave, stdin=slave, stderr=slave, start_new_session=True, close_fds=True,
-                preexec_fn=clear_handled_signals)
-        except FileNotFoundError:
-            log_error('Could not find shell to read environment')
-            return ans
-        with os.fdopen(master, 'rb') as stdout, os.fdopen(slave, 'wb'):
-            raw = b''
-            from time import monotonic
-            start_time = monotonic()
-            while monotonic() - start_time < 1.5:
-                try:
-                    ret: Optional[int] = p.wait(0.01)
-                except subprocess.TimeoutExpired:
-                    ret = None
-                with suppress(Exception):
-                    raw += stdout.read()
-                if ret is not None:
+@lru_cache(maxsize=8)
+def _read_shell_environment(shell: tuple[str, ...]) -> dict[str, str]:
+    from .child import openpty
+    ans: dict[str, str] = {}
+    import subprocess
+    cmd = list(shell)
+    master, slave = openpty()
+    os.set_blocking(master, False)
+    if '-l' not in cmd and '--login' not in cmd:
+        cmd += ['-l']
+    if '-i' not in cmd and '--interactive' not in cmd:
+        cmd += ['-i']
+    try:
+        p = subprocess.Popen(
+            cmd + ['-c', 'env'], stdout=slave, stdin=slave, stderr=slave, start_new_session=True, close_fds=True,
+            preexec_fn=clear_handled_signals)
+    except FileNotFoundError:
+        os.close(master)
+        os.close(slave)
+        log_error('Could not find shell to read environment')
+        return ans
+    # Close our copy of the slave so that reading from master signals EOF once
+    # the shell has exited
+    os.close(slave)
+    raw = b''
+    try:
+        from time import monotonic
+        start_time = monotonic()
+        shell_exited = False
+        while (remaining := 1.5 - (monotonic() - start_time)) > 0:
+            # Wake up periodically to check for the shell having exited, in
+            # case some process it started is still holding the tty open
+            if not shell_exited and not select.select([master], [], [], min(remaining, 0.05))[0]:
+                shell_exited = p.poll() is not None
+                continue
+            try:
+                x = os.read(master, 65536)
+            except BlockingIOError:
+                if shell_exited:
                     break
-            if cast(Optional[int], p.returncode) is None:
-                log_error('Timed out waiting for shell to quit while reading shell environment')
-                p.kill()
-            elif p.returncode == 0:
-                while True:
-                    try:
-                        x = stdout.read()
-                    except Exception:
-                        break
-                    if not x:
-                        break
-                    raw += x
-                draw = raw.decode('utf-8', 'replace')
-                for line in draw.splitlines():
-                    k, v = line.partition('=')[::2]
-                    if k and v:
-                        ans[k] = v
-            else:
-                log_error('Failed to run shell to read its environment')
+                continue
+            except OSError:  # EIO on Linux when the slave is closed
+                x = b''
+            if not x:
+                with suppress(subprocess.TimeoutExpired):
+                    p.wait(remaining)
+                break
+            raw += x
+    finally:
+        os.close(master)
+    if cast(Optional[int], p.returncode) is None:
+        log_error('Timed out waiting for shell to quit while reading shell environment')
+        p.kill()
+    elif p.returncode == 0:
+        draw = raw.decode('utf-8', 'replace')
+        for line in draw.splitlines():
+            k, v = line.partition('=')[::2]
+            if k and v:
+                ans[k] = v
+    else:
+        log_error('Failed to run shell to read its environment')
     return ans
 
 
+def read_shell_environment(opts: Optional[Options] = None) -> dict[str, str]:
+    return _read_shell_environment(tuple(resolved_shell(opts)))
+
+
 def parse_uri_list(text: str) -> Generator[str, None, None]:
     ' Get paths from file:// URLs '
     from urllib.parse import unquote, urlparse
@@ -906,6 +949,11 @@ def parse_uri_list(text: str) -> Generator[str, None, None]:
         if not line.startswith('file://'):
             yield line
             continue
+        if line[7:8] == '/' and '\t' not in line:
+            # fast path for the common case of no hostname, where urlparse()
+            # would just drop the query
+            yield unquote(line[7:].partition('?')[0])
+            continue
         try:
             purl = urlparse(line, allow_fragments=False)
         except Exception:
@@ -950,54 +998,52 @@ def get_new_os_window_size(
     return w, h
 
 
-def get_all_processes() -> Iterable[int]:
+def get_all_processes() -> tuple[int, ...]:
     if is_macos:
         from kitty.fast_data_types import get_all_processes as f
-        yield from f()
-    else:
-        for c in os.listdir('/proc'):
-            if c.isdigit():
-                yield int(c)
+        return f()
+    with os.scandir('/proc') as it:
+        return tuple(int(x.name) for x in it if x.name.isdigit())
 
 
 def is_kitty_gui_cmdline(*cmd: str) -> bool:
-    if not cmd:
-        return False
-    if os.path.basename(cmd[0]) != 'kitty':
+    if not cmd or cmd[0].rpartition('/')[2] != 'kitty':
         return False
     if len(cmd) == 1:
         return True
-    s = cmd[1][:1]
-    if s == '@':
-        return False
-    if s == '+':
-        if cmd[1] == '+':
-            return len(cmd) > 2 and cmd[2] == 'open'
-        return cmd[1] == '+open'
-    return True
+    q = cmd[1]
+    if q == '+':
+        return len(cmd) > 2 and cmd[2] == 'open'
+    return q == '+open' or q[:1] not in ('@', '+')
 
 
 def reload_conf_in_all_kitties() -> None:
     import signal
 
-    from kitty.child import cmdline_of_pid
+    from kitty.child import cmdline_of_pid_containing
 
     for pid in get_all_processes():
         try:
-            cmd = cmdline_of_pid(pid)
+            cmd = cmdline_of_pid_containing(pid, b'kitty')
         except Exception:
             continue
         if cmd and is_kitty_gui_cmdline(*cmd):
-            os.kill(pid, signal.SIGUSR1)
+            with suppress(OSError):
+                os.kill(pid, signal.SIGUSR1)
 
 
-@run_once
-def control_codes_pat() -> 'Pattern[str]':
-    return re.compile('[\x00-\x09\x0b-\x1f\x7f-\x9f]')
+control_codes_pat = re.compile('[\x00-\x09\x0b-\x1f\x7f-\x9f]')
+
+
+control_codes_removal_table = dict.fromkeys((*range(0x0a), *range(0x0b, 0x20), *range(0x7f, 0xa0)))
 
 
 def sanitize_control_codes(text: str, replace_with: str = '') -> str:
-    return control_codes_pat().sub(replace_with, text)
+    # str.translate() is much faster than regex substitution for ASCII text
+    # but much slower otherwise
+    if not replace_with and text.isascii():
+        return text.translate(control_codes_removal_table)
+    return control_codes_pat.sub(replace_with, text)
 
 
 def hold_till_enter() -> None:
@@ -1007,37 +1053,77 @@ def hold_till_enter() -> None:
     subprocess.Popen([kitten_exe(), '__hold_till_enter__']).wait()
 
 
+def spawn_with_handled_signals_cleared(argv: Sequence[str]) -> Callable[[], Any]:
+    '''
+    Run argv with stdin, stdout and stderr connected to /dev/null, the signals
+    handled by kitty reset and all other file descriptors closed. Uses
+    posix_spawn() to avoid the cost of forking a large process when the
+    platform can close descriptors in the child, otherwise falls back to
+    subprocess. Returns a function that waits for the child to exit.
+    '''
+    closefrom = getattr(os, 'POSIX_SPAWN_CLOSEFROM', None)
+    if closefrom is None:
+        import subprocess
+        return subprocess.Popen(
+            argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, preexec_fn=clear_handled_signals).wait
+    import signal
+
+    from .constants import handled_signals
+    kw: dict[str, Any] = {}
+    if handled_signals:
+        kw['setsigdef'] = handled_signals
+        if hasattr(signal, 'pthread_sigmask'):
+            kw['setsigmask'] = signal.pthread_sigmask(signal.SIG_BLOCK, ()) - handled_signals
+    file_actions: list[tuple[int, ...]] = [(os.POSIX_SPAWN_OPEN, fd, os.devnull, os.O_RDWR, 0) for fd in (0, 1, 2)]
+    file_actions.append((closefrom, 3))
+    pid = os.posix_spawnp(argv[0], argv, os.environ, file_actions=file_actions, **kw)
+
+    def wait() -> None:
+        with suppress(ChildProcessError):
+            os.waitpid(pid, 0)
+    return wait
+
+
 def cleanup_ssh_control_masters() -> None:
-    import glob
-    import subprocess
+    prefix, _, suffix = ssh_control_master_template.format(kitty_pid=os.getpid(), ssh_placeholder='*').partition('*')
     try:
-        files = frozenset(glob.glob(os.path.join(runtime_dir(), ssh_control_master_template.format(
-            kitty_pid=os.getpid(), ssh_placeholder='*'))))
+        with os.scandir(runtime_dir()) as it:
+            files = tuple(e.path for e in it if e.name.startswith(prefix) and e.name.endswith(suffix))
     except OSError:
         return
-    workers = tuple(subprocess.Popen([
-        'ssh', '-o', f'ControlPath={x}', '-O', 'exit', 'kitty-unused-host-name'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-        preexec_fn=clear_handled_signals) for x in files)
-    for w in workers:
-        w.wait()
+    # All the ssh processes run concurrently. They are waited on in order and
+    # each socket is removed once its ssh process has been waited on.
+    workers: list[tuple[Optional[Callable[[], Any]], str]] = []
     for x in files:
+        try:
+            wait: Optional[Callable[[], Any]] = spawn_with_handled_signals_cleared((
+                'ssh', '-o', f'ControlPath={x}', '-O', 'exit', 'kitty-unused-host-name'))
+        except OSError:
+            wait = None
+        workers.append((wait, x))
+    for wait, x in workers:
+        if wait is not None:
+            wait()
         with suppress(OSError):
             os.remove(x)
 
 
+@lru_cache(maxsize=128)
 def path_from_osc7_url(url: Union[str, bytes]) -> str:
     if isinstance(url, bytes):
         url = url.decode('utf-8')
     if url.startswith('kitty-shell-cwd://'):
         return '/' + url.split('/', 3)[-1]
     if url.startswith('file://'):
-        from urllib.parse import unquote, urlparse
-        return unquote(urlparse(url).path)
+        from urllib.parse import unquote, urlsplit
+        return unquote(urlsplit(url).path)
     return ''
 
 
 @run_once
 def macos_version() -> tuple[int, ...]:
+    if not is_macos:
+        return 0, 0, 0
     # platform.mac_ver does not work thanks to Apple's stupid "hardening", so just use sw_vers
     import subprocess
     try:
@@ -1047,17 +1133,39 @@ def macos_version() -> tuple[int, ...]:
     return tuple(map(int, o.strip().split('.')))
 
 
+less_version_pat = re.compile(r'less (\d+)')
+
+
 @lru_cache(maxsize=2)
 def less_version(less_exe: str = 'less') -> int:
+    # Failures are cached as version zero so that a broken or missing less is
+    # not run again on every call
     import subprocess
-    o = subprocess.check_output([less_exe, '-V'], stderr=subprocess.STDOUT).decode()
-    m = re.match(r'less (\d+)', o)
+    try:
+        o = subprocess.check_output([less_exe, '-V'], stderr=subprocess.STDOUT).decode()
+    except Exception as e:
+        log_error(f'Failed to get version of less with error: {e}')
+        return 0
+    m = less_version_pat.match(o)
     if m is None:
-        raise ValueError(f'Invalid version string for less: {o}')
+        log_error(f'Invalid version string for less: {o}')
+        return 0
     return int(m.group(1))
 
 
 def is_pid_alive(pid: int) -> bool:
+    if sys.platform == 'linux':
+        try:
+            with open(f'/proc/{pid}/stat', 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            pass  # either dead or hidden by the hidepid mount option, os.kill() will tell
+        except OSError:
+            return True
+        else:
+            # The state field follows the parenthesized command name, zombie
+            # and dead processes are not alive
+            return raw[raw.rfind(b')') + 2:][:1] not in (b'Z', b'X', b'x')
     try:
         os.kill(pid, 0)
     except ProcessLookupError:
@@ -1070,9 +1178,11 @@ def is_pid_alive(pid: int) -> bool:
 def safer_fork() -> int:
     pid = os.fork()
     if pid:
-        # master
-        import ssl
-        ssl.RAND_add(os.urandom(32), 0.0)
+        # master, reseed the OpenSSL RNG so it differs from the child's,
+        # not needed if ssl was never loaded as there is no state to share
+        ssl = sys.modules.get('ssl')
+        if ssl is not None:
+            ssl.RAND_add(os.urandom(32), 0.0)
     else:
         # child
         import atexit
@@ -1080,10 +1190,16 @@ def safer_fork() -> int:
     return pid
 
 
+@lru_cache(maxsize=256)
+def _resolve_ref_cached(ref: str) -> str:
+    from .conf.types import resolve_ref
+    return resolve_ref(ref, lambda x: x)
+
+
+@lru_cache(maxsize=64)
 def docs_url(which: str = '', local_docs_root: Optional[str] = '') -> str:
     from urllib.parse import quote
 
-    from .conf.types import resolve_ref
     from .constants import local_docs, website_url
     if local_docs_root is None:
         ld = ''
@@ -1093,7 +1209,7 @@ def docs_url(which: str = '', local_docs_root: Optional[str] = '') -> str:
     base = base.strip('/')
     if frag.startswith('ref='):
         ref = frag[4:]
-        which = resolve_ref(ref, lambda x: x)
+        which = _resolve_ref_cached(ref)
         if which.startswith('https://') or which.startswith('http://'):
             return which
         base, frag = which.partition('#')[::2]
@@ -1108,26 +1224,30 @@ def docs_url(which: str = '', local_docs_root: Optional[str] = '') -> str:
     return url
 
 
+bracketed_paste_end_pat = re.compile(b'(?:(?:\033\\\x5b)|(?:\x9b))201~')
+
+
 def sanitize_for_bracketed_paste(text: bytes) -> bytes:
-    pat = re.compile(b'(?:(?:\033\\\x5b)|(?:\x9b))201~')
+    # Removing an end marker can create a new one from the surrounding bytes,
+    # so repeat until nothing is removed
     while True:
-        new_text = pat.sub(b'', text)
-        if new_text == text:
-            break
-        text = new_text
-    return text
+        text, num = bracketed_paste_end_pat.subn(b'', text)
+        if not num:
+            return text
 
 
-@lru_cache(maxsize=64)
+@lru_cache(maxsize=256)
 def sanitize_url_for_dispay_to_user(url: str) -> str:
-    from urllib.parse import unquote, urlparse, urlunparse
+    if '//' not in url and '%' not in url:
+        return url  # no netloc and nothing to unquote
+    from urllib.parse import unquote, urlsplit, urlunsplit
     try:
-        purl = urlparse(url)
+        purl = urlsplit(url)
         if purl.netloc:
             purl = purl._replace(netloc=purl.netloc.encode('idna').decode('ascii'))
         if purl.path:
             purl = purl._replace(path=unquote(purl.path))
-        url = urlunparse(purl)
+        url = urlunsplit(purl)
     except Exception as e:
         log_error(e)
         url = 'Unparseable URL: ' + url
@@ -1137,30 +1257,51 @@ def sanitize_url_for_dispay_to_user(url: str) -> str:
 def extract_all_from_tarfile_safely(tf: 'tarfile.TarFile', dest: str) -> None:
     # Ensure that all extracted items are within dest
 
-    def is_within_directory(directory: str, target: str) -> bool:
-        abs_directory = os.path.abspath(directory)
+    def is_within_directory(abs_directory: str, abs_directory_prefix: str, target: str) -> bool:
+        # commonprefix() is character based, so it would accept /dest-evil for /dest
         abs_target = os.path.abspath(target)
-        prefix = os.path.commonprefix((abs_directory, abs_target))
-        return prefix == abs_directory
+        return abs_target == abs_directory or abs_target.startswith(abs_directory_prefix)
 
     def safe_extract(tar: 'tarfile.TarFile', path: str = ".", numeric_owner: bool = False) -> None:
-        for member in tar.getmembers():
+        members = tar.getmembers()
+        abs_path = os.path.abspath(path)
+        abs_path_prefix = os.path.join(abs_path, '')
+        for member in members:
             member_path = os.path.join(path, member.name)
-            if not is_within_directory(path, member_path):
+            if not is_within_directory(abs_path, abs_path_prefix, member_path):
                 raise ValueError(f'Attempted path traversal in tar file: {member.name}')
-        tar.extractall(path, tar.getmembers(), numeric_owner=numeric_owner)
+        tar.extractall(path, members, numeric_owner=numeric_owner)
 
     safe_extract(tf, dest)
 
 
 def is_png(path: str) -> bool:
     if path:
-        with suppress(Exception), open(path, 'rb') as f:
-            header = f.read(8)
-            return header.startswith(b'\211PNG\r\n\032\n')
+        # use unbuffered OS level I/O as we need only the 8 byte signature
+        with suppress(Exception):
+            fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            try:
+                return os.pread(fd, 8, 0) == b'\211PNG\r\n\032\n'
+            finally:
+                os.close(fd)
     return False
 
 
+# the characters for which shlex.quote() quotes its argument
+shell_unsafe_chars_pat = re.compile(r'[^\w@%+=:,./-]', re.ASCII)
+
+
+@lru_cache(maxsize=16)
+def cmdline_prefix_for_hold(shell_cmd: tuple[str, ...], shell_integration: frozenset[str]) -> tuple[str, ...]:
+    ksi = ' '.join(shell_integration)
+    if all(shell_cmd) and shell_unsafe_chars_pat.search(''.join(shell_cmd)) is None:
+        shell = ' '.join(shell_cmd)  # no quoting needed, same result as shlex.join()
+    else:
+        import shlex
+        shell = shlex.join(shell_cmd)
+    return kitten_exe(), 'run-shell', f'--shell={shell}', f'--shell-integration={ksi}', '--env=KITTY_HOLD=1'
+
+
 def cmdline_for_hold(cmd: Sequence[str] = (), opts: Optional['Options'] = None) -> list[str]:
     if opts is None:
         with suppress(RuntimeError):
@@ -1168,10 +1309,7 @@ def cmdline_for_hold(cmd: Sequence[str] = (), opts: Optional['Options'] = None)
     if opts is None:
         from .options.types import defaults
         opts = defaults
-    ksi = ' '.join(opts.shell_integration)
-    import shlex
-    shell = shlex.join(resolved_shell(opts))
-    return [kitten_exe(), 'run-shell', f'--shell={shell}', f'--shell-integration={ksi}', '--env=KITTY_HOLD=1'] + list(cmd)
+    return [*cmdline_prefix_for_hold(tuple(resolved_shell(opts)), opts.shell_integration), *cmd]
 
 
 def safe_mtime(path: str) -> Optional[float]:
@@ -1221,12 +1359,10 @@ def timed_debug_print(*a: Any, sep: str = ' ', end: str = '\n') -> None:
 def lock_file(f: BinaryIO) -> None:
     if not f.writable():
         raise ValueError('Cannot lock files not opened in writable mode')
-    import fcntl
     fcntl.lockf(f, fcntl.LOCK_EX)
 
 
 def unlock_file(f: BinaryIO) -> None:
     if not f.writable():
         raise ValueError('Cannot unlock files not opened in writable mode')
-    import fcntl
     fcntl.lockf(f, fcntl.LOCK_UN)
@@ -93,7 +93,7 @@
     color_as_int,
     docs_url,
     key_val_matcher,
-    kitty_ansi_sanitizer_pat,
+    kitty_ansi_pat,
     log_error,
     open_cmd,
     open_url,
@@ -412,7 +412,7 @@ def func(text: str) -> str:
 
 
 def text_sanitizer(as_ansi: bool, add_wrap_markers: bool) -> Callable[[str], str]:
-    pat = kitty_ansi_sanitizer_pat()
+    pat = kitty_ansi_pat
     ansi, wrap_markers = not as_ansi, not add_wrap_markers
 
     def remove_wrap_markers(line: str) -> str:
@@ -1274,10 +1274,10 @@ def set_color_table_color(self, code: int, bvalue: Optional[memoryview] = None)
 
         def parse_color_set(raw: str) -> Generator[tuple[int, Optional[int]], None, None]:
             parts = raw.split(';')
-            lp = len(parts)
-            if lp % 2 != 0:
+            if len(parts) % 2 != 0:
                 return
-            for c_, spec in [parts[i:i + 2] for i in range(0, len(parts), 2)]:
+            it = iter(parts)
+            for c_, spec in zip(it, it):
                 try:
                     c = int(c_)
                     if c < 0 or c > 255:
@@ -19,7 +19,15 @@
 )
 from kitty.fast_data_types import Cursor as C
 from kitty.rgb import to_color
-from kitty.utils import is_ok_to_read_image_file, is_path_in_temp_dir, sanitize_title, sanitize_url_for_dispay_to_user, shlex_split_with_positions
+from kitty.utils import (
+    Flag,
+    fit_image,
+    is_ok_to_read_image_file,
+    is_path_in_temp_dir,
+    sanitize_title,
+    sanitize_url_for_dispay_to_user,
+    shlex_split_with_positions,
+)
 
 from . import BaseTest, filled_cursor, filled_history_buf, filled_line_buf
 
@@ -34,6 +42,14 @@ def create_lbuf(*lines):
     return ans
 
 
+def write_script(tdir, name, body):
+    path = os.path.join(tdir, name)
+    with open(path, 'w') as f:
+        f.write(f'#!/bin/sh\n{body}\n')
+    os.chmod(path, 0o755)
+    return path
+
+
 class TestDataTypes(BaseTest):
 
 
@@ -473,6 +489,28 @@ def on_csi(x):
                 self.assertTrue(is_ok_to_read_image_file(tf.name, tf.fileno()), fifo)
         self.ae(sanitize_url_for_dispay_to_user(
             'h://a\u0430b.com/El%20Ni%C3%B1o/'), 'h://xn--ab-7kc.com/El Niño/')
+        f = Flag(False)
+        with f:
+            self.assertTrue(f)
+            with f:
+                self.assertTrue(f)
+            self.assertTrue(f)
+        self.assertFalse(f)
+        for args, expected in {
+            (100, 50, 100, 50): (100, 50),
+            (10, 20, 100, 50): (10, 20),
+            (200, 100, 100, 100): (100, 50),
+            (100, 200, 100, 100): (50, 100),
+            (200, 100, 100, 50): (100, 50),
+            (3, 3, 2, 2): (2, 2),
+            (1, 1000, 10, 10): (0, 10),
+            (1000, 1, 10, 10): (10, 0),
+            (52, 4693, 8, 1159): (8, 722),
+            (0, 10, 0, 5): (0, 5),
+            (10, 0, 5, 0): (5, 0),
+            (0, 0, 0, 0): (0, 0),
+        }.items():
+            self.ae(fit_image(*args), expected, f'Failed for: {args}')
 
     def test_historybuf(self):
         lb = filled_line_buf()
@@ -595,6 +633,74 @@ def test_bracketed_paste_sanitizer(self):
             self.assertNotIn('\x9b201~'.encode(), q)
             self.assertIn(b'ab', q)
 
+    def test_is_pid_alive(self):
+        from kitty.utils import is_pid_alive
+        self.assertTrue(is_pid_alive(os.getpid()))
+        pid = os.fork()
+        if not pid:
+            os._exit(0)
+        try:
+            if sys.platform == 'linux':
+                # wait for the child to exit without reaping it so it is a zombie
+                os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+                self.assertFalse(is_pid_alive(pid))
+        finally:
+            os.waitpid(pid, 0)
+        self.assertFalse(is_pid_alive(pid))
+
+    def test_less_version(self):
+        from kitty.utils import less_version, suppress_error_logging
+        with tempfile.TemporaryDirectory() as tdir:
+            self.ae(less_version(write_script(tdir, 'good', 'echo "less 643 (PCRE2 regular expressions)"')), 643)
+            with suppress_error_logging():
+                self.ae(less_version(write_script(tdir, 'bad', 'echo "not less"')), 0)
+                self.ae(less_version(os.path.join(tdir, 'missing')), 0)
+
+    def test_read_shell_environment(self):
+        from types import SimpleNamespace
+
+        from kitty.utils import read_shell_environment
+        with tempfile.TemporaryDirectory() as tdir:
+            a, b = (write_script(tdir, name, 'echo "KITTY_TEST_SHELL_PID=$$"') for name in 'ab')
+            env = read_shell_environment(SimpleNamespace(shell=a, term='xterm-kitty'))
+            self.assertIn('KITTY_TEST_SHELL_PID', env)
+            # the shell is run only once per command line
+            self.assertIs(read_shell_environment(SimpleNamespace(shell=a, term='xterm-kitty')), env)
+            self.assertNotEqual(
+                read_shell_environment(SimpleNamespace(shell=b, term='xterm-kitty'))['KITTY_TEST_SHELL_PID'], env['KITTY_TEST_SHELL_PID'])
+
+    def test_extract_tarfile_safely(self):
+        import io
+        import tarfile
+
+        from kitty.utils import extract_all_from_tarfile_safely
+
+        def tar_with(*members):
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode='w') as tf:
+                for name in members:
+                    ti = tarfile.TarInfo(name)
+                    if name.endswith('/') or name == '.':
+                        ti.type = tarfile.DIRTYPE
+                        ti.mode = 0o755
+                        tf.addfile(ti)
+                    else:
+                        ti.size = 1
+                        tf.addfile(ti, io.BytesIO(b'x'))
+            buf.seek(0)
+            return tarfile.open(fileobj=buf)
+
+        with tempfile.TemporaryDirectory() as tdir:
+            dest = os.path.join(tdir, 'dest')
+            os.mkdir(dest)
+            with tar_with('../dest-evil/x') as tf, self.assertRaises(ValueError):
+                extract_all_from_tarfile_safely(tf, dest)
+            self.assertFalse(os.path.exists(os.path.join(tdir, 'dest-evil')))
+            with tar_with('.', 'a/', 'a/b') as tf:
+                extract_all_from_tarfile_safely(tf, dest)
+            with open(os.path.join(dest, 'a', 'b')) as f:
+                self.ae(f.read(), 'x')
+
     def test_expand_ansi_c_escapes(self):
         for src, expected in {
             'abc': 'abc',